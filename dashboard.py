@@ -1,3 +1,5 @@
+import os
+
 import pandas as pd
 import numpy as np
 import plotly.express as px
@@ -5,8 +7,14 @@ import altair as alt
 import streamlit as st
 import statsmodels.formula.api as smf
 
+from src.filtered_model import build_sufficient_stats, fit_filtered_model, predict_filtered_model
+from src.influence import compute_influence
+
 # from sklearn.metrics import mean_squared_error
 
+# merged data set to load (can be pointed at another file, e.g. by the load test harness)
+DATA_PATH = os.environ.get('AQI_ASTHMA_DATA', 'processed_data/merged_data_2013-2022.csv')
+
 
 @st.cache_data
 def load_data(path):
@@ -21,7 +29,22 @@ def load_data(path):
     df['y_pred'] = model.fittedvalues
     df['residual'] = df['asthma_rate'] - df['y_pred']
 
-    return df, model
+    # per county-year cross-products, used to refit the model on the sidebar selection
+    stats = build_sufficient_stats(df)
+
+    return df, model, stats
+
+
+@st.cache_data(max_entries=256, ttl=3600)
+def fit_selected_model(_stats, years, counties):
+    # refit the model on the selected years & counties (cached per selection)
+    return fit_filtered_model(_stats, years, counties)
+
+
+@st.cache_data(max_entries=64)
+def load_influence(df):
+    # leverage, cook's distance & dfbeta of the AQI slope for every county-year
+    return compute_influence(df)
 
 
 def plot_prediction_accuracy(df, years):
@@ -110,6 +133,36 @@ def plot_top_ten_counties_by_metric(df, years, metric, title):
     )
 
 
+def plot_influential_observations(influence):
+    top_influence = (
+        influence
+        .sort_values('cooks_d', ascending=False)
+        .head(10)
+    )
+    top_influence = top_influence.assign(
+        county_year=top_influence['county'].astype(str) + ' ' + top_influence['year'].astype(str))
+
+    return (
+        alt.Chart(top_influence)
+        .mark_bar()
+        .encode(
+            x=alt.X('cooks_d:Q', title="Cook's Distance",
+                    axis=alt.Axis(tickCount=10)),
+            y=alt.Y('county_year:N', sort='-x', title='County-Year'),
+            color=alt.Color('dfbeta_aqi:Q', scale=alt.Scale(
+                scheme='redblue', domainMid=0), title='Change in AQI Slope'),
+            tooltip=[
+                alt.Tooltip('county:N', title='County'),
+                alt.Tooltip('year:O', title='Year'),
+                alt.Tooltip('cooks_d:Q', title="Cook's Distance", format='.4f'),
+                alt.Tooltip('leverage:Q', title='Leverage', format='.3f'),
+                alt.Tooltip('dfbeta_aqi:Q', title='Change in AQI Slope', format='.4f')
+            ]
+        )
+        .properties(title='Most Influential County-Years', width=600, height=400)
+    )
+
+
 def plot_time_series(df, group_by, color, title, show_covid):
     yearly_avg = df.groupby(group_by)['asthma_rate'].mean().reset_index()
 
@@ -128,13 +181,13 @@ def plot_time_series(df, group_by, color, title, show_covid):
 
 def compute_model_metrics(df, model):
     # mse  = mean_squared_error(df['asthma_rate'], df['y_pred'])
-    # rmse = np.sqrt(mse)
+    rmse = np.sqrt(np.mean(df['residual'] ** 2))
     slope = model.params['median_aqi']
     pval = model.pvalues['median_aqi']
     return {
         'r2':        model.rsquared,
         'adj_r2':    model.rsquared_adj,
-        # 'rmse':      rmse,
+        'rmse':      rmse,
         'slope':     slope,
         'pval':   pval,
         'n_obs':     int(model.nobs)
@@ -186,7 +239,7 @@ def main():
             """)
 
     # Load data & compute model
-    df, model = load_data('processed_data/merged_data_2013-2022.csv')
+    df, model, stats = load_data(DATA_PATH)
     years = sorted(df['year'].unique())
     counties = sorted(df['county'].unique())
 
@@ -269,16 +322,42 @@ def main():
     if selected_counties:
         filtered = filtered[filtered['county'].isin(selected_counties)]
 
+    # Model fitted on the selected data (falls back to the full data model if it can't be fitted)
+    selected_fit = fit_selected_model(
+        stats, tuple(selected_years), tuple(selected_counties))
+    if selected_fit is not None:
+        metrics = selected_fit
+        filtered = filtered.assign(
+            y_pred=predict_filtered_model(selected_fit, filtered))
+        filtered = filtered.assign(
+            residual=filtered['asthma_rate'] - filtered['y_pred'])
+    else:
+        metrics = compute_model_metrics(df, model)
+
+    # shown in every tab that reports the model when the selection couldn't be fitted
+    fallback_warning = "Not enough data in this selection to fit the model (try more years or counties), showing the model fitted on all data."
+
+    if metrics['pval'] < 0.001:
+        significance = "Very strong"
+    elif metrics['pval'] < 0.01:
+        significance = "Strong"
+    elif metrics['pval'] < 0.05:
+        significance = "Moderate"
+    else:
+        significance = "Not significant"
+    is_significant = metrics['pval'] < 0.05
+
     # Covid filter
     show_covid = st.sidebar.checkbox("Highlight COVID-19 Impact", value=True)
 
     # Tab layout for different analyses
-    tab1, tab2, tab3, tab4 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
         # "County Differences",
         "Time Trends",
         "Air Quality Impact",
         "Regression Model",
-        "Model Results"
+        "Model Results",
+        "Influential Data"
     ])
 
     with tab1:
@@ -359,33 +438,45 @@ def main():
             st.metric("Relationship Strength", strength)
 
         st.header("Solution: Multiple Regression Model")
-        st.markdown("""
+        if selected_fit is None:
+            st.warning(fallback_warning)
+        link = "positive" if metrics['slope'] > 0 else "negative"
+        if is_significant:
+            link = f"{link}, statistically significant link"
+        else:
+            link = f"{link} link that isn't statistically significant for the selected data"
+        st.markdown(f"""
         - The model accounts for differences between counties and years so it measures the AQI effect directly
-        - It shows a **positive, statistically significant link:**
+        - It shows a **{link}:**
         """)
 
-        st.success("""
-        Each 1-point rise in AQI predicts about 0.2 more asthma ER visits (per 10,000), demonstrating air quality really does matter!
-        """)
+        aqi_effect = f"Each 1-point rise in AQI predicts about {abs(metrics['slope']):.2f} {'more' if metrics['slope'] > 0 else 'fewer'} asthma ER visits (per 10,000)"
+        if is_significant and metrics['slope'] > 0:
+            st.success(
+                f"{aqi_effect}, demonstrating air quality really does matter!")
+        else:
+            st.info(f"{aqi_effect}.")
         st.markdown(
             "*More on the model's findings are continued in the **next tabs**!*")
 
     with tab3:
         st.subheader("How the Model Works")
-        st.markdown("""
+        st.markdown(f"""
         - The model examines past asthma rates in each county to establish a “usual” rate for that location and measures how much rates rise when AQI changes—so it captures both the location effect and the air quality effect.
         - It then adjusts those baseline and AQI effect numbers so its predictions line up as closely as possible with the actual data, highlighting each factor's impact
-        - A good fit (low prediction error) means its estimates like “each AQI point adds about 0.2 visits” are more likely to reflect real world patterns
+        - A good fit (low prediction error) means its estimates like “each AQI point changes visits by about {metrics['slope']:+.2f}” are more likely to reflect real world patterns
         """)
         st.subheader("How Accurate is the Model?")
+        if selected_fit is None:
+            st.warning(fallback_warning)
 
         # Model Prediction Accuracy
         st.altair_chart(plot_prediction_accuracy(
             filtered, selected_years), use_container_width=True)
         st.markdown(
             "This plot compares observed vs. predicted rates, points near the red line show strong prediction accuracy.")
-        st.success("""
-        The model predicts to within ±5.8 visits per 10,000
+        st.success(f"""
+        The model predicts to within ±{metrics['rmse']:.1f} visits per 10,000
         """)
 
         # Prediction Errors
@@ -408,7 +499,8 @@ def main():
         - It then adjusts those baseline and AQI effect numbers so its predictions line up as closely as possible with the actual data, highlighting each factor's impact
         """)
 
-        metrics = compute_model_metrics(df, model)
+        if selected_fit is None:
+            st.warning(fallback_warning)
 
         # Model results
         col1, col2 = st.columns(2)
@@ -418,31 +510,83 @@ def main():
             **Model Statistics:**
             - **R²**: {metrics['r2']:.3f}
             - **Slope (AQI)**: {metrics['slope']:.3f}
-            - **RMSE**: 5.76
-            - **Statistical Significance**: Very strong (p < {metrics['pval']:.3f})
+            - **RMSE**: {metrics['rmse']:.2f}
+            - **Statistical Significance**: {significance} (p = {metrics['pval']:.4f})
+            - **Observations**: {metrics['n_obs']}
             """)
+            if selected_fit is not None:
+                st.caption("*Statistics are for the selected years and counties*")
+            else:
+                st.caption("*Statistics are for the model fitted on all data*")
 
         with col2:
-            st.success("""
+            if is_significant:
+                reliability = """- The results are statistically reliable
+            - We can be confident the findings aren't due to chance"""
+            else:
+                reliability = """- The AQI effect is not statistically significant for this selection
+            - It could be due to chance (try a wider year range or more counties)"""
+            st.success(f"""
             **What This Means:**
-            - The model can explain 87.56% of why asthma rates vary
-            - Finds each 10-point AQI increase raises asthma visits by +2 per 10,000
-            - Predicts to within ±5.8 visits per 10,000
-            - The results are statistically reliable
-            - We can be confident the findings aren't due to chance
+            - The model can explain {metrics['r2'] * 100:.2f}% of why asthma rates vary
+            - Finds each 10-point AQI increase {'raises' if metrics['slope'] > 0 else 'lowers'} asthma visits by {abs(metrics['slope']) * 10:.1f} per 10,000
+            - Predicts to within ±{metrics['rmse']:.1f} visits per 10,000
+            {reliability}
             """)
 
         # Comparison with simple analysis
-        st.warning("""
+        if is_significant:
+            advanced = "After accounting for location, air quality does matter"
+        else:
+            advanced = "After accounting for location, the air quality effect isn't significant for this selection"
+        st.warning(f"""
         **Why The First Analysis Was Wrong:**
         
-        **Simple Analysis**: "Air quality and asthma barely correlate" (R² ≈ 0.012)
+        **Simple Analysis**: "Air quality and asthma barely correlate" (R² ≈ {r_squared:.3f})
         
-        **Advanced Analysis**: "After accounting for location, air quality does matter" (R² = 0.876)
+        **Advanced Analysis**: "{advanced}" (R² = {metrics['r2']:.3f})
         
         Sometimes you need to control for confounding factors to see the real relationships!
         """)
 
+    with tab5:
+        st.header("Which County-Years Drive the AQI Effect?")
+        st.markdown("""
+        - Some observations pull the model's AQI slope more than others, usually unusual AQI or asthma values for that county and year
+        - **Cook's distance** measures how much all of the model's predictions change when one county-year is left out
+        - **Change in AQI slope** (DFBETA) is how much the AQI effect would drop (positive) or rise (negative) without that county-year
+        """)
+
+        if selected_fit is not None:
+            st.markdown(
+                "*Diagnostics are for the model fitted on the selected years and counties*")
+            influence = load_influence(
+                filtered[['county', 'year', 'asthma_rate', 'median_aqi']])
+        else:
+            st.warning(fallback_warning)
+            influence = load_influence(df)
+            influence = influence[influence['year'].isin(selected_years)]
+            if selected_counties:
+                influence = influence[influence['county'].isin(selected_counties)]
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Flagged County-Years", int(influence['influential'].sum()),
+                      help="Cook's distance above 4/n or scaled change in AQI slope above 2/√n")
+        with col2:
+            st.metric("Largest Change in AQI Slope",
+                      f"{influence['dfbeta_aqi'].abs().max():.3f}",
+                      help=f"Compared to the model's slope of {metrics['slope']:.3f}")
+
+        st.altair_chart(plot_influential_observations(
+            influence), use_container_width=True)
+
+        st.dataframe(
+            influence[influence['influential']]
+            .sort_values('cooks_d', ascending=False)
+            .drop(columns=['influential']),
+            use_container_width=True)
+
     st.markdown("---")
 
     # Data Table & Download
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+
+
+# per (county, year) cell sums of the model's cross-products for
+# 'asthma_rate ~ median_aqi + C(county) + C(year)'
+# summing the cells over any set of years/counties gives that selection's blocks,
+# so the model can be refitted for a filter without touching the rows again
+def build_sufficient_stats(df, y='asthma_rate', x='median_aqi'):
+    county_codes, counties = pd.factorize(df['county'], sort=True)
+    year_codes, years = pd.factorize(df['year'], sort=True)
+    shape = (len(counties), len(years))
+
+    y_values = df[y].to_numpy(dtype=float)
+    x_values = df[x].to_numpy(dtype=float)
+
+    stats = {'counties': counties, 'years': years}
+    for name, values in [('n', np.ones(len(df))), ('sx', x_values), ('sy', y_values),
+                         ('sxx', x_values * x_values), ('sxy', x_values * y_values),
+                         ('syy', y_values * y_values)]:
+        stats[name] = np.zeros(shape)
+        np.add.at(stats[name], (county_codes, year_codes), values)
+
+    return stats
+
+
+# fit the fixed effects model on the selected years and counties (all counties if empty)
+# county effects are solved out in closed form, leaving a (years x years) system,
+# so the cost depends on the number of counties and years, not on the number of rows
+# returns None when the AQI slope can't be estimated on the selection (e.g. a single year)
+def fit_filtered_model(stats, years, counties=None):
+    year_mask = stats['years'].isin(years)
+    county_mask = stats['counties'].isin(counties) if counties else np.ones(
+        len(stats['counties']), dtype=bool)
+
+    def select(name):
+        return stats[name][np.ix_(county_mask, year_mask)]
+
+    n, sx, sy, sxx, sxy, syy = (select(name) for name in ['n', 'sx', 'sy', 'sxx', 'sxy', 'syy'])
+
+    # drop counties and years with no observations in the selection
+    county_keep = n.sum(axis=1) > 0
+    year_keep = n.sum(axis=0) > 0
+    n, sx, sy = (a[np.ix_(county_keep, year_keep)] for a in (n, sx, sy))
+    county_names = stats['counties'][county_mask][county_keep]
+    year_names = stats['years'][year_mask][year_keep]
+
+    n_obs = n.sum()
+    n_counties, n_years = n.shape
+    n_params = n_counties + n_years
+    if n_obs - n_params <= 0:
+        return None
+
+    # county totals (n_c, sx_c, sy_c) and year totals (n_t, sx_t, sy_t)
+    n_c, sx_c, sy_c = n.sum(axis=1), sx.sum(axis=1), sy.sum(axis=1)
+    n_t, sx_t, sy_t = n.sum(axis=0), sx.sum(axis=0), sy.sum(axis=0)
+    share = n / n_c[:, None]
+
+    # normal equations for (year effects, slope) after substituting out the county effects;
+    # the first year is the baseline (its effect is 0)
+    lhs = np.zeros((n_years + 1, n_years + 1))
+    lhs[:n_years, :n_years] = np.diag(n_t) - n.T @ share
+    lhs[:n_years, n_years] = lhs[n_years, :n_years] = sx_t - share.T @ sx_c
+    lhs[n_years, n_years] = sxx.sum() - np.sum(sx_c ** 2 / n_c)
+    rhs = np.append(sy_t - share.T @ sy_c, sxy.sum() - np.sum(sx_c * sy_c / n_c))
+    lhs, rhs = lhs[1:, 1:], rhs[1:]
+
+    if np.linalg.matrix_rank(lhs) < len(rhs):
+        return None
+    lhs_inv = np.linalg.inv(lhs)
+    solution = lhs_inv @ rhs
+
+    year_effects = np.append(0.0, solution[:-1])
+    slope = solution[-1]
+    county_effects = (sy_c - n @ year_effects - slope * sx_c) / n_c
+
+    rss = (syy.sum() - county_effects @ sy_c - year_effects @ sy_t - slope * sxy.sum())
+    tss = syy.sum() - sy.sum() ** 2 / n_obs
+    df_resid = n_obs - n_params
+    r2 = 1 - rss / tss
+    se = np.sqrt(rss / df_resid * lhs_inv[-1, -1])
+
+    # same keys as compute_model_metrics in dashboard.py, plus what's needed to predict
+    return {
+        'r2':             r2,
+        'adj_r2':         1 - (n_obs - 1) / df_resid * (1 - r2),
+        'rmse':           np.sqrt(rss / n_obs),
+        'slope':          slope,
+        'se':             se,
+        'pval':           2 * t_dist.sf(abs(slope / se), df_resid),
+        'n_obs':          int(n_obs),
+        'county_effects': pd.Series(county_effects, index=county_names),
+        'year_effects':   pd.Series(year_effects, index=year_names),
+    }
+
+
+# fitted asthma rates for rows of the selection the model was fitted on
+def predict_filtered_model(fit, df, x='median_aqi'):
+    return (fit['county_effects'].reindex(df['county']).to_numpy()
+            + fit['year_effects'].reindex(df['year']).to_numpy()
+            + fit['slope'] * df[x].to_numpy(dtype=float))
+
+
+if __name__ == "__main__":
+    df = pd.read_csv('processed_data/merged_data_2013-2022.csv').drop(columns=["Unnamed: 0"])
+    stats = build_sufficient_stats(df)
+
+    fit = fit_filtered_model(stats, range(2015, 2020), ['Alameda', 'Fresno', 'Kern', 'Los Angeles'])
+    print(f"R2: {fit['r2']:.3f}  slope: {fit['slope']:.3f}  p: {fit['pval']:.3f}  n: {fit['n_obs']}")
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+# influence diagnostics for the AQI slope in 'asthma_rate ~ median_aqi + C(county) + C(year)'
+# computed without forming the hat matrix or the dummy design:
+# - county effects are removed by within-county demeaning
+# - year effects are then removed by projecting on the (county-demeaned) year dummies,
+#   which only needs a small (years x years) matrix
+# the leverage of the dummy model splits the same way (county part + year part + AQI part),
+# so everything below is O(n * years^2)
+def compute_influence(df, y='asthma_rate', x='median_aqi', county='county', year='year'):
+    county_codes, _ = pd.factorize(df[county])
+    year_codes, year_levels = pd.factorize(df[year])
+    n = len(df)
+
+    county_counts = np.bincount(county_codes)
+
+    # year dummies with county means removed: (n x years)
+    cell_counts = np.zeros((len(county_counts), len(year_levels)))
+    np.add.at(cell_counts, (county_codes, year_codes), 1.0)
+    year_dummies = np.zeros((n, len(year_levels)))
+    year_dummies[np.arange(n), year_codes] = 1.0
+    year_dummies -= (cell_counts / county_counts[:, None])[county_codes]
+
+    # the year dummies sum to the (absorbed) intercept, so drop the first year as the baseline
+    year_dummies = year_dummies[:, 1:]
+    gram = year_dummies.T @ year_dummies
+    gram_inv = np.linalg.pinv(gram, rcond=1e-10, hermitian=True)
+    year_rank = np.linalg.matrix_rank(gram, hermitian=True)
+
+    def residualize(values):
+        values = values - (np.bincount(county_codes, weights=values) / county_counts)[county_codes]
+        return values - year_dummies @ (gram_inv @ (year_dummies.T @ values))
+
+    y_tilde = residualize(df[y].to_numpy(dtype=float))
+    x_tilde = residualize(df[x].to_numpy(dtype=float))
+
+    # same slope and residuals as the full dummy regression (frisch-waugh-lovell)
+    sxx = x_tilde @ x_tilde
+    slope = (x_tilde @ y_tilde) / sxx
+    resid = y_tilde - slope * x_tilde
+
+    # diagonal of the hat matrix
+    leverage = (1.0 / county_counts[county_codes]
+                + np.einsum('ij,jk,ik->i', year_dummies, gram_inv, year_dummies)
+                + x_tilde ** 2 / sxx)
+
+    n_params = len(county_counts) + year_rank + 1
+    df_resid = n - n_params
+    sigma2 = resid @ resid / df_resid
+
+    # observations with leverage 1 (e.g. a county with a single year) fit perfectly
+    # and have no leave-one-out estimate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        one_minus_h = np.where(leverage < 1 - 1e-10, 1 - leverage, np.nan)
+        cooks_d = resid ** 2 * leverage / (n_params * sigma2 * one_minus_h ** 2)
+        # change in the AQI slope when the observation is left out (slope - slope without i)
+        dfbeta = x_tilde * resid / (sxx * one_minus_h)
+        sigma2_without_i = (df_resid * sigma2 - resid ** 2 / one_minus_h) / (df_resid - 1)
+        dfbetas = dfbeta * np.sqrt(sxx / sigma2_without_i)
+
+    influence = pd.DataFrame({
+        county:        df[county].to_numpy(),
+        year:          df[year].to_numpy(),
+        'leverage':    leverage,
+        'cooks_d':     cooks_d,
+        'dfbeta_aqi':  dfbeta,
+        'dfbetas_aqi': dfbetas,
+    }, index=df.index)
+
+    # common rules of thumb: cook's d > 4/n or |dfbetas| > 2/sqrt(n)
+    influence['influential'] = ((influence['cooks_d'] > 4 / n)
+                                | (influence['dfbetas_aqi'].abs() > 2 / np.sqrt(n)))
+
+    return influence
+
+
+if __name__ == "__main__":
+    df = pd.read_csv('processed_data/merged_data_2013-2022.csv').drop(columns=["Unnamed: 0"])
+
+    influence = compute_influence(df)
+    print(influence.sort_values('cooks_d', ascending=False).head(10))
@@ -0,0 +1,324 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DASHBOARD = os.path.join(REPO_ROOT, 'dashboard.py')
+DEFAULT_DATA = os.path.join(REPO_ROOT, 'processed_data', 'merged_data_2013-2022.csv')
+
+# relative frequency of each interaction a simulated user makes
+INTERACTIONS = {
+    'move_year_slider': 0.4,
+    'select_counties':  0.3,
+    'clear_counties':   0.1,
+    'switch_year_mode': 0.1,
+    'toggle_covid':     0.1,
+}
+
+
+# synthetic county-year panel with the same columns as processed_data/merged_data_2013-2022.csv
+# (about 3,100 counties x 10 years mirrors the size of a national roll-out)
+def make_synthetic_panel(n_counties=3100, start_year=2013, num_years=10, seed=0):
+    rng = np.random.default_rng(seed)
+    counties = np.array([f'County {i:04d}' for i in range(n_counties)])
+    years = np.arange(start_year, start_year + num_years)
+
+    df = pd.DataFrame({
+        'county': np.repeat(counties, num_years),
+        'year':   np.tile(years, n_counties),
+    })
+    n = len(df)
+
+    # like the real data, a few county-years are missing
+    df = df[rng.random(n) > 0.05].reset_index(drop=True)
+    n = len(df)
+    county_idx = pd.factorize(df['county'])[0]
+    year_idx = df['year'].to_numpy() - start_year
+
+    days = np.full(n, 365)
+    median_aqi = np.clip(rng.normal(40, 8, n_counties)[county_idx] + rng.normal(0, 5, n), 5, 150)
+    good_days = np.clip(rng.normal(250, 60, n), 0, 365).astype(int)
+    moderate_days = np.clip(days - good_days - rng.integers(0, 15, n), 0, None)
+    unhealthy_sensitive_days = np.clip(days - good_days - moderate_days, 0, None)
+
+    # county + year effects + ~0.2 visits per AQI point, as in the fitted model
+    asthma_rate = np.clip(
+        rng.normal(45, 15, n_counties)[county_idx]
+        + rng.normal(0, 5, num_years)[year_idx]
+        + 0.2 * median_aqi + rng.normal(0, 5, n), 1, None)
+    population = np.exp(rng.normal(11, 1.3, n_counties))[county_idx]
+
+    df['days_with_aqi'] = days
+    df['good_days'] = good_days
+    df['moderate_days'] = moderate_days
+    df['unhealthy_for_sensitive_groups_days'] = unhealthy_sensitive_days
+    df['unhealthy_days'] = 0
+    df['very_unhealthy_days'] = 0
+    df['hazardous_days'] = 0
+    df['max_aqi'] = (median_aqi * rng.uniform(2, 4, n)).round().astype(int)
+    df['90th_percentile_aqi'] = (median_aqi * rng.uniform(1.3, 1.8, n)).round().astype(int)
+    df['median_aqi'] = median_aqi.round().astype(int)
+    df['days_co'] = 0
+    df['days_no2'] = rng.integers(0, 20, n)
+    df['days_ozone'] = rng.integers(100, 300, n)
+    df['days_pm2.5'] = days - df['days_ozone'] - df['days_no2']
+    df['days_pm10'] = 0
+    df['asthma_rate'] = asthma_rate.round(2)
+    df['number_of_cases'] = np.round(asthma_rate * population / 10000)
+
+    return df
+
+
+# one simulated user: open the dashboard, then replay random sidebar interactions
+# runs in its own process, so cpu time and peak memory are per session
+# (note: st.cache_data is per process here, unlike one shared streamlit server, so every
+#  session pays the cold load_data cost once; that rerun is reported separately)
+# a rerun that fails or times out ends the session with status 'error' and what was
+# measured up to that point
+def run_session(session_id, data_path, n_interactions=20, seed=0, think_time=0.0, timeout=120):
+    session_start = time.perf_counter()
+    os.environ['AQI_ASTHMA_DATA'] = data_path
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    rng = np.random.default_rng([seed, session_id])
+    names = list(INTERACTIONS)
+    probabilities = np.array(list(INTERACTIONS.values()))
+    probabilities /= probabilities.sum()
+
+    cpu_start = time.process_time()
+    initial_load = np.nan
+    latencies = []
+    errors = 0
+    status, error = 'ok', ''
+
+    try:
+        at = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+
+        start = time.perf_counter()
+        at.run()
+        initial_load = time.perf_counter() - start
+        errors = len(at.exception)
+
+        for _ in range(n_interactions):
+            if think_time:
+                time.sleep(rng.exponential(think_time))
+
+            _interact(at, rng.choice(names, p=probabilities), rng)
+
+            start = time.perf_counter()
+            at.run()
+            latencies.append(time.perf_counter() - start)
+            errors += len(at.exception)
+    except Exception as e:
+        # e.g. AppTest raises RuntimeError when a rerun exceeds the timeout
+        status, error = 'error', f'{type(e).__name__}: {e}'
+
+    return {
+        'session':      session_id,
+        'status':       status,
+        'error':        error,
+        'elapsed':      time.perf_counter() - session_start,
+        'initial_load': initial_load,
+        'latencies':    latencies,
+        'cpu_seconds':  time.process_time() - cpu_start,
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_mb':  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'errors':       errors,
+    }
+
+
+# result for a session whose process died without reporting back (e.g. killed when out of memory)
+def _failed_session(session_id, error, elapsed):
+    return {
+        'session':      session_id,
+        'status':       'crashed',
+        'error':        error,
+        'elapsed':      elapsed,
+        'initial_load': np.nan,
+        'latencies':    [],
+        'cpu_seconds':  np.nan,
+        'peak_rss_mb':  np.nan,
+        'errors':       0,
+    }
+
+
+def _session_worker(results, *args):
+    results.put(run_session(*args))
+
+
+# change one sidebar widget the way a user would (the rerun is triggered by the caller)
+def _interact(at, action, rng):
+    mode = at.sidebar.radio[0]
+    slider = at.sidebar.slider[0]
+    counties = at.sidebar.multiselect[0]
+
+    if action == 'move_year_slider':
+        low, high = slider.min, slider.max
+        if mode.value == 'Single Year':
+            slider.set_value(int(rng.integers(low, high + 1)))
+        else:
+            start, end = sorted(rng.integers(low, high + 1, size=2))
+            slider.set_value((int(start), int(end)))
+    elif action == 'select_counties':
+        chosen = rng.choice(counties.options, size=rng.integers(1, 6), replace=False)
+        counties.set_value(list(chosen))
+    elif action == 'clear_counties':
+        counties.set_value([])
+    elif action == 'switch_year_mode':
+        mode.set_value('Year Range' if mode.value == 'Single Year' else 'Single Year')
+    elif action == 'toggle_covid':
+        checkbox = at.sidebar.checkbox[0]
+        checkbox.set_value(not checkbox.value)
+
+
+# start `sessions` simulated users at once and collect per-session results
+# every session gets its own process, so peak memory is per session and a session that
+# crashes (or is killed for running out of memory) only loses its own result
+def run_load_test(sessions=8, n_interactions=20, data_path=DEFAULT_DATA, seed=0,
+                  think_time=0.0, timeout=120):
+    context = multiprocessing.get_context('spawn')
+    results_queue = context.Queue()
+    start = time.perf_counter()
+    processes = [
+        context.Process(target=_session_worker,
+                        args=(results_queue, i, data_path, n_interactions, seed, think_time, timeout))
+        for i in range(sessions)]
+    for process in processes:
+        process.start()
+
+    results = {}
+    while len(results) < sessions:
+        try:
+            result = results_queue.get(timeout=1)
+            results[result['session']] = result
+            continue
+        except queue.Empty:
+            pass
+
+        dead = [i for i, process in enumerate(processes)
+                if i not in results and not process.is_alive()]
+        if not dead:
+            continue
+
+        # a process that just finished may have reported after the timeout above
+        while True:
+            try:
+                result = results_queue.get_nowait()
+                results[result['session']] = result
+            except queue.Empty:
+                break
+
+        for i in dead:
+            if i not in results:
+                exitcode = processes[i].exitcode
+                error = f'worker exited with code {exitcode}'
+                if exitcode == -9:
+                    error += ' (killed, likely out of memory)'
+                results[i] = _failed_session(i, error, time.perf_counter() - start)
+
+    for process in processes:
+        process.join()
+
+    return [results[i] for i in range(sessions)]
+
+
+# summary table: one row per session plus an "all" row pooling the sessions that finished
+def summarize(results):
+    rows = []
+    for r in results:
+        latencies = np.array(r['latencies'])
+        rows.append({
+            'session':         r['session'],
+            'status':          r['status'],
+            'elapsed_s':       r['elapsed'],
+            'reruns':          len(latencies),
+            'initial_load_s':  r['initial_load'],
+            **_percentiles(latencies),
+            'cpu_s':           r['cpu_seconds'],
+            'cpu_per_rerun_s': r['cpu_seconds'] / (len(latencies) + 1),
+            'peak_rss_mb':     r['peak_rss_mb'],
+            'errors':          r['errors'],
+            'error':           r['error'],
+        })
+    summary = pd.DataFrame(rows)
+
+    finished = [r for r in results if r['status'] == 'ok']
+    ok = summary[summary['status'] == 'ok']
+    pooled = np.concatenate([r['latencies'] for r in finished]) if finished else np.array([])
+    overall = {
+        'session':         'all',
+        'status':          f'{len(finished)}/{len(results)} ok',
+        'elapsed_s':       summary['elapsed_s'].max(),
+        'reruns':          len(pooled),
+        'initial_load_s':  ok['initial_load_s'].mean(),
+        **_percentiles(pooled),
+        'cpu_s':           ok['cpu_s'].sum() if finished else np.nan,
+        'cpu_per_rerun_s': ok['cpu_s'].sum() / (len(pooled) + len(finished)) if finished else np.nan,
+        'peak_rss_mb':     ok['peak_rss_mb'].mean(),
+        'errors':          ok['errors'].sum(),
+        'error':           '',
+    }
+    return pd.concat([summary, pd.DataFrame([overall])], ignore_index=True)
+
+
+# p50/p95/p99 of rerun latencies (NaN when there were no reruns, e.g. --interactions 0)
+def _percentiles(latencies):
+    if len(latencies) == 0:
+        return {'p50_s': np.nan, 'p95_s': np.nan, 'p99_s': np.nan}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'p50_s': p50, 'p95_s': p95, 'p99_s': p99}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate concurrent dashboard sessions and report rerun latency, CPU and memory")
+    parser.add_argument('--sessions', type=int, default=None,
+                        help="number of concurrent sessions (default 8, or 1 with --national)")
+    parser.add_argument('--interactions', type=int, default=20,
+                        help="sidebar interactions replayed per session")
+    parser.add_argument('--national', action='store_true',
+                        help="run against a synthetic national-scale panel instead of the CA data; "
+                             "each session needs roughly 6 GB of memory at the default 3,100 "
+                             "counties (load_data's dummy-variable OLS grows with counties squared)")
+    parser.add_argument('--counties', type=int, default=3100,
+                        help="number of counties in the synthetic panel (with --national)")
+    parser.add_argument('--data', default=DEFAULT_DATA, help="merged data csv to load")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="mean pause between interactions in seconds")
+    parser.add_argument('--timeout', type=float, default=120, help="timeout per rerun in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.sessions is None:
+        args.sessions = 1 if args.national else 8
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = args.data
+        if args.national:
+            data_path = os.path.join(tmp, 'synthetic_national_panel.csv')
+            make_synthetic_panel(args.counties, seed=args.seed).to_csv(data_path)
+
+        results = run_load_test(args.sessions, args.interactions, data_path,
+                                args.seed, args.think_time, args.timeout)
+
+    print(f"{args.sessions} concurrent sessions x {args.interactions} interactions "
+          f"on {'synthetic national panel' if args.national else data_path}")
+    print("Note: each session is a separate process with its own st.cache_data, so this measures "
+          f"{args.sessions} independent apps, not {args.sessions} sessions sharing one server's cache")
+    summary = summarize(results)
+    summary['error'] = summary['error'].str.slice(0, 80)
+    print(summary.round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
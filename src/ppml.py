@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+
+# poisson pseudo-maximum-likelihood (PPML) with absorbed fixed effects
+# model: E[y] = exposure * exp(x'b + county effect + year effect)
+# instead of expanding C(county)/C(year) dummies, the fixed effects are swept out of the
+# working variable and regressors (weighted alternating projections) inside every IRLS step.
+# the fixed effect estimates from the previous step are reused as the starting point
+# (warm start), so each sweep only has to correct a small change.
+def fit_ppml(df, y='number_of_cases', x=('median_aqi',), fe=('county', 'year'),
+             exposure=None, cluster='county', tol=1e-8, max_iter=100):
+    x = [x] if isinstance(x, str) else list(x)
+    fe = [fe] if isinstance(fe, str) else list(fe)
+
+    columns = list(dict.fromkeys([y] + x + fe + ([cluster] if cluster else []) +
+                                 ([exposure] if exposure else [])))
+    data = df[columns].dropna()
+    if exposure:
+        data = data[data[exposure] > 0]
+    n_input = len(data)
+
+    # groups whose outcome is always zero push their effect to -inf (no finite estimate),
+    # so drop them, repeating until every remaining group has at least one positive count
+    while True:
+        keep = np.ones(len(data), dtype=bool)
+        for name in fe:
+            keep &= data.groupby(name)[y].transform('sum').to_numpy() > 0
+        if keep.all():
+            break
+        data = data[keep]
+
+    y_obs = data[y].to_numpy(dtype=float)
+    X = data[x].to_numpy(dtype=float)
+    offset = np.log(data[exposure].to_numpy(dtype=float)) if exposure else np.zeros(len(data))
+    codes = [pd.factorize(data[name])[0] for name in fe]
+
+    # starting values (as in ppmlhdfe): halfway between each count and the mean count
+    mu = (y_obs + y_obs.mean()) / 2
+    eta = np.log(mu)
+    fe_start = None
+    deviance = np.inf
+    change = np.inf
+    converged = False
+
+    for iteration in range(1, max_iter + 1):
+        # IRLS working variable and weights for the poisson log link
+        z = eta - offset + (y_obs - mu) / mu
+        weights = mu
+
+        # loose inner tolerance early on, tightening as the outer loop converges
+        inner_tol = max(tol, min(1e-4, 0.1 * change))
+        demeaned, fe_start = _absorb(np.column_stack([z, X]), codes, weights,
+                                     tol=inner_tol, start=fe_start)
+        z_tilde, X_tilde = demeaned[:, 0], demeaned[:, 1:]
+
+        sqrt_w = np.sqrt(weights)[:, None]
+        beta = np.linalg.lstsq(sqrt_w * X_tilde, sqrt_w[:, 0] * z_tilde, rcond=None)[0]
+
+        # fitted linear predictor = working variable minus the demeaned regression residual
+        eta = z - (z_tilde - X_tilde @ beta) + offset
+        mu = np.exp(eta)
+
+        deviance_old = deviance
+        deviance = _poisson_deviance(y_obs, mu)
+        change = _relative_change(deviance, deviance_old)
+        if change < tol:
+            converged = True
+            break
+
+    # cluster-robust (sandwich) covariance built from the demeaned regressors
+    # (weights and regressors from the final IRLS step, which is the converged fit)
+    bread = np.linalg.inv(X_tilde.T @ (weights[:, None] * X_tilde))
+    scores = X_tilde * (y_obs - mu)[:, None]
+    if cluster:
+        groups = pd.factorize(data[cluster])[0]
+        n_clusters = groups.max() + 1
+        cluster_scores = np.column_stack(
+            [np.bincount(groups, weights=scores[:, j], minlength=n_clusters)
+             for j in range(len(x))])
+        meat = cluster_scores.T @ cluster_scores
+        correction = n_clusters / (n_clusters - 1)
+    else:
+        n_clusters = None
+        meat = scores.T @ scores
+        correction = len(y_obs) / (len(y_obs) - len(x))
+    cov = correction * bread @ meat @ bread
+
+    params = pd.Series(beta, index=x)
+    bse = pd.Series(np.sqrt(np.diag(cov)), index=x)
+    z_crit = norm.ppf(0.975)
+
+    return {
+        'params':        params,
+        'bse':           bse,
+        'pvalues':       pd.Series(2 * norm.sf(np.abs(params / bse)), index=x),
+        # multiplicative change in the expected count per one-unit increase of each regressor
+        'rate_ratio':    np.exp(params),
+        'rate_ratio_ci': pd.DataFrame({'lower': np.exp(params - z_crit * bse),
+                                       'upper': np.exp(params + z_crit * bse)}),
+        'cov':           pd.DataFrame(cov, index=x, columns=x),
+        'fitted':        pd.Series(mu, index=data.index),
+        'deviance':      deviance,
+        'n_obs':         len(y_obs),
+        'n_dropped':     n_input - len(y_obs),
+        'n_clusters':    n_clusters,
+        'iterations':    iteration,
+        'converged':     converged,
+    }
+
+
+# summary of the AQI effect in the same style as compute_model_metrics in dashboard.py
+def compute_ppml_metrics(result, term='median_aqi'):
+    return {
+        'rate_ratio': result['rate_ratio'][term],
+        'ci_lower':   result['rate_ratio_ci'].loc[term, 'lower'],
+        'ci_upper':   result['rate_ratio_ci'].loc[term, 'upper'],
+        'pct_change': 100 * (result['rate_ratio'][term] - 1),
+        'pval':       result['pvalues'][term],
+        'n_obs':      result['n_obs'],
+    }
+
+
+# sweep fixed effects out of every column of `values` by weighted alternating projections
+# (subtract weighted group means of one fixed effect at a time until nothing changes)
+# `start` holds accumulated group means from a previous call and is used as a warm start
+# returns the demeaned columns and the updated accumulated means
+def _absorb(values, codes, weights, tol=1e-8, max_iter=10000, start=None):
+    n_cols = values.shape[1]
+    group_weights = [np.bincount(c, weights=weights) for c in codes]
+
+    if start is None:
+        effects = [np.zeros((len(w), n_cols)) for w in group_weights]
+    else:
+        effects = [e.copy() for e in start]
+
+    resid = values - sum(e[c] for e, c in zip(effects, codes))
+    scale = np.maximum(np.abs(values).max(axis=0), 1.0)
+
+    for _ in range(max_iter):
+        largest_update = 0.0
+        for k, c in enumerate(codes):
+            means = np.column_stack(
+                [np.bincount(c, weights=weights * resid[:, j]) for j in range(n_cols)]
+            ) / group_weights[k][:, None]
+            resid -= means[c]
+            effects[k] += means
+            largest_update = max(largest_update, np.max(np.abs(means) / scale))
+        if largest_update < tol:
+            break
+
+    return resid, effects
+
+
+def _poisson_deviance(y, mu):
+    # y * log(y / mu) is taken as 0 when y is 0
+    ratio = np.where(y > 0, y / mu, 1.0)
+    return 2 * np.sum(y * np.log(ratio) - (y - mu))
+
+
+def _relative_change(new, old):
+    if not np.isfinite(old):
+        return np.inf
+    return abs(new - old) / max(abs(new), 0.1)
+
+
+if __name__ == "__main__":
+    df = pd.read_csv('processed_data/merged_data_2013-2022.csv').drop(columns=["Unnamed: 0"])
+
+    # population is not in the merged data; the implied population
+    # (cases / age-adjusted rate per 10k) is used as the exposure
+    df['population'] = df['number_of_cases'] / df['asthma_rate'] * 10000
+
+    result = fit_ppml(df, exposure='population')
+    metrics = compute_ppml_metrics(result)
+    print(f"Rate ratio per AQI point: {metrics['rate_ratio']:.4f} "
+          f"(95% CI {metrics['ci_lower']:.4f} - {metrics['ci_upper']:.4f}), "
+          f"p = {metrics['pval']:.4f}, n = {metrics['n_obs']}")
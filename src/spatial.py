@@ -0,0 +1,237 @@
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+
+
+# load county polygons from a local GeoJSON boundary file
+# returns {county id: list of rings (each ring an (m, 2) array of lon/lat vertices)}
+# note: at national scale county names repeat across states, so use a FIPS field as id_field
+def load_county_boundaries(path, id_field='NAME'):
+    with open(path) as f:
+        features = json.load(f)['features']
+
+    boundaries = {}
+    for feature in features:
+        geometry = feature['geometry']
+        if geometry is None:
+            continue
+
+        # Polygon = list of rings, MultiPolygon = list of polygons
+        polygons = geometry['coordinates']
+        if geometry['type'] == 'Polygon':
+            polygons = [polygons]
+
+        rings = boundaries.setdefault(feature['properties'][id_field], [])
+        for polygon in polygons:
+            rings.extend(np.asarray(ring, dtype=float)[:, :2] for ring in polygon)
+
+    return boundaries
+
+
+# find pairs of neighbouring counties from their shared boundary
+# queen = counties touch at any vertex, rook = counties share at least one edge
+# vertices are snapped to `precision` decimal places so tiny digitising differences still match
+def find_neighbours(boundaries, counties, contiguity='queen', precision=6):
+    if contiguity not in ('queen', 'rook'):
+        raise ValueError("contiguity must be 'queen' or 'rook'")
+
+    scale = 10 ** precision
+    keys = []
+    owners = []
+    for i, county in enumerate(counties):
+        for ring in boundaries.get(county, []):
+            vertices = np.round(ring * scale).astype(np.int64)
+            if contiguity == 'queen':
+                ring_keys = vertices
+            else:
+                # an edge is the (unordered) pair of its two end vertices
+                start, end = vertices[:-1], vertices[1:]
+                swap = (start[:, 0] > end[:, 0]) | (
+                    (start[:, 0] == end[:, 0]) & (start[:, 1] > end[:, 1]))
+                start, end = np.where(swap[:, None], end, start), np.where(
+                    swap[:, None], start, end)
+                ring_keys = np.hstack([start, end])
+            keys.append(ring_keys)
+            owners.append(np.full(len(ring_keys), i))
+
+    if not keys:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # one row per (boundary key, county), then self-join on the key to get touching pairs
+    key_cols = [f'k{j}' for j in range(keys[0].shape[1])]
+    points = pd.DataFrame(np.vstack(keys), columns=key_cols)
+    points['county'] = np.concatenate(owners)
+    points = points.drop_duplicates()
+
+    # only keys shared by more than one county can produce a pair
+    points = points[points.duplicated(key_cols, keep=False)]
+    pairs = points.merge(points, on=key_cols)
+    pairs = pairs[pairs['county_x'] != pairs['county_y']]
+
+    return np.unique(pairs[['county_x', 'county_y']].to_numpy(dtype=np.int64), axis=0)
+
+
+# build a sparse (n x n) spatial weights matrix, rows/columns ordered like `counties`
+# style 'b' = binary 0/1 contiguity, 'r' = row-standardised (each row sums to 1)
+def build_weights(neighbours, counties, style='r'):
+    n = len(counties)
+    neighbours = np.asarray(neighbours, dtype=np.int64).reshape(-1, 2)
+    W = sparse.csr_matrix(
+        (np.ones(len(neighbours)), (neighbours[:, 0], neighbours[:, 1])), shape=(n, n))
+    W.sum_duplicates()
+    W.data[:] = 1.0
+
+    if style == 'r':
+        W = row_standardize(W)
+    elif style != 'b':
+        raise ValueError("style must be 'b' or 'r'")
+
+    return W
+
+
+# scale every row to sum to 1 (counties without neighbours, "islands", stay all zero)
+def row_standardize(W):
+    row_sums = np.asarray(W.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    return sparse.diags(scale) @ W
+
+
+# spatially lagged value: weighted average of a county's neighbours
+def spatial_lag(W, values):
+    return W @ np.asarray(values, dtype=float)
+
+
+# add a spatially lagged column (e.g. neighbours' median aqi) to the county-year panel
+# the lag is taken within each year and only over neighbours that have data that year,
+# so all years are lagged together with a single sparse matrix product
+def add_spatial_lag(df, W, counties, column='median_aqi', name=None):
+    name = name or f'{column}_lag'
+    county_idx = pd.Index(counties).get_indexer(df['county'])
+    if (county_idx < 0).any():
+        missing = df.loc[county_idx < 0, 'county'].unique()
+        raise KeyError(f"Counties missing from the weights matrix: {list(missing)}")
+
+    years, year_idx = np.unique(df['year'].to_numpy(), return_inverse=True)
+
+    # (county x year) grid of values and a mask of which cells have data
+    values = np.zeros((len(counties), len(years)))
+    present = np.zeros((len(counties), len(years)))
+    values[county_idx, year_idx] = df[column].to_numpy(dtype=float)
+    present[county_idx, year_idx] = 1.0
+
+    # re-normalising by the weight of neighbours present gives the average over available ones
+    weighted_sum = W @ values
+    weight_present = W @ present
+    lag = np.divide(weighted_sum, weight_present,
+                    out=np.full_like(weighted_sum, np.nan), where=weight_present > 0)
+
+    df = df.copy()
+    df[name] = lag[county_idx, year_idx]
+    return df
+
+
+# global moran's I with analytic (normality) and permutation inference
+# permutations are run in batches: each batch is one sparse (n x n) @ dense (n x batch) product
+def morans_i(W, values, permutations=999, batch_size=500, seed=None):
+    W = sparse.csr_matrix(W)
+    z = np.asarray(values, dtype=float)
+    z = z - z.mean()
+    n = len(z)
+
+    s0 = W.sum()
+    zz = z @ z
+
+    # constant values (or no neighbours at all) leave I undefined
+    if zz == 0 or s0 == 0:
+        result = {'I': np.nan, 'expected_I': -1.0 / (n - 1), 'z_norm': np.nan,
+                  'p_norm': np.nan, 'n': n}
+        if permutations:
+            result.update(p_sim=np.nan, z_sim=np.nan)
+        return result
+
+    I = n / s0 * (z @ (W @ z)) / zz
+
+    # moments of I under the normality assumption
+    expected = -1.0 / (n - 1)
+    W_sym = W + W.T
+    s1 = 0.5 * W_sym.multiply(W_sym).sum()
+    s2 = np.sum((np.asarray(W.sum(axis=1)).ravel() + np.asarray(W.sum(axis=0)).ravel()) ** 2)
+    variance = (n ** 2 * s1 - n * s2 + 3 * s0 ** 2) / ((n ** 2 - 1) * s0 ** 2) - expected ** 2
+    z_norm = (I - expected) / np.sqrt(variance)
+
+    result = {
+        'I': I,
+        'expected_I': expected,
+        'z_norm': z_norm,
+        'p_norm': 2 * norm.sf(abs(z_norm)),
+        'n': n,
+    }
+
+    if permutations:
+        rng = np.random.default_rng(seed)
+        simulated = np.empty(permutations)
+        for start in range(0, permutations, batch_size):
+            size = min(batch_size, permutations - start)
+            # each column is an independent random relabelling of the counties
+            Z = rng.permuted(np.tile(z, (size, 1)), axis=1).T
+            simulated[start:start + size] = n / s0 * np.einsum('ij,ij->j', Z, W @ Z) / zz
+
+        # pseudo p-value in the direction of the observed statistic
+        larger = np.sum(simulated >= I)
+        if permutations - larger < larger:
+            larger = permutations - larger
+        result['p_sim'] = (larger + 1.0) / (permutations + 1.0)
+        result['z_sim'] = (I - simulated.mean()) / simulated.std()
+
+    return result
+
+
+# moran's I of a panel column (e.g. model residuals) computed separately for each year
+# W should be binary; it is subset to the counties observed that year and re-standardised
+def morans_i_by_year(df, W, counties, column='residual', permutations=999, seed=None):
+    W = sparse.csr_matrix(W)
+    county_index = pd.Index(counties)
+    rng = np.random.default_rng(seed)
+
+    county_idx = county_index.get_indexer(df['county'])
+    if (county_idx < 0).any():
+        missing = df.loc[county_idx < 0, 'county'].unique()
+        raise KeyError(f"Counties missing from the weights matrix: {list(missing)}")
+
+    rows = []
+    for year, group in df.groupby('year'):
+        idx = county_index.get_indexer(group['county'])
+        W_year = row_standardize(W[idx][:, idx])
+
+        # skip years where nobody has an observed neighbour, or where every value is
+        # the same (moran's I is undefined for both)
+        values = group[column].to_numpy(dtype=float)
+        if W_year.nnz == 0 or np.all(values == values[0]):
+            continue
+
+        stats = morans_i(W_year, values, permutations=permutations, seed=rng)
+        rows.append({'year': year, **stats})
+
+    if not rows:
+        return pd.DataFrame(index=pd.Index([], name='year'))
+    return pd.DataFrame(rows).set_index('year')
+
+
+if __name__ == "__main__":
+    from clean_data import all_counties
+
+    boundaries = load_county_boundaries('raw_data/california_counties.geojson')
+    W = build_weights(find_neighbours(boundaries, all_counties), all_counties, style='b')
+
+    df = pd.read_csv('processed_data/merged_data_2013-2022.csv').drop(columns=["Unnamed: 0"])
+    df = add_spatial_lag(df, W, all_counties, 'median_aqi')
+    print(df[['county', 'year', 'median_aqi', 'median_aqi_lag']].head())
+
+    # are the fixed effects model residuals spatially autocorrelated?
+    import statsmodels.formula.api as smf
+    model = smf.ols('asthma_rate ~ median_aqi + C(county) + C(year)', data=df).fit()
+    df['residual'] = model.resid
+    print(morans_i_by_year(df, W, all_counties, 'residual', seed=0))